@@ -1,36 +1,90 @@
 #!/usr/bin/env python
 import os
+import sys
+import atexit
+import signal
+import threading
 
 from flask import Flask
 from flask_cors import CORS
-
-# Import the X-Ray modules
-from aws_xray_sdk.core import xray_recorder, patch_all
-from aws_xray_sdk.ext.flask.middleware import XRayMiddleware
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 # Add new blueprints here
 if __package__ is None or __package__ == '':
     # uses current directory visibility
 	from customer_routes import customer_module
+	from custom_logger import setup_logger
+	import db
+	import tracing
+	import write_behind
+	import customer_table_client
+	import rate_limiter
 else:
     # uses current package visibility
     from flaskr.customer_routes import customer_module
+    from flaskr.custom_logger import setup_logger
+    from flaskr import db
+    from flaskr import tracing
+    from flaskr import write_behind
+    from flaskr import customer_table_client
+    from flaskr import rate_limiter
+
+logger = setup_logger(__name__)
+
+def warm_up():
+	"""
+	Pre-warms the AWS clients before the app starts serving. Failures are
+	logged rather than raised, a cold first request is better than no pod.
+	"""
+	try:
+		db.warm_up()
+		logger.info("Warm up complete")
+	except Exception as e:
+		logger.error(e)
+
+def _exit_on_sigterm(signum, frame):
+	# Kubernetes stops pods with SIGTERM, exiting normally runs the atexit
+	# handlers so the write-behind buffer is flushed before the pod goes
+	sys.exit(0)
 
-def create_app():
+def create_app(start_workers=True):
 	# create and configure the app
 	app = Flask(__name__, instance_relative_config=True)
 	CORS(app)
 
-	# AWS X-Ray
-	# Should only be available in staging and production environment, (AWS cloud)
-	# will not use AWS X-ray if environment is development
-	if os.environ.get("FLASK_ENV") != 'development':
-		plugins = ('EC2Plugin', 'ECSPlugin')
-		xray_recorder.configure(service='myproject-customer-service',plugins=plugins)
-		XRayMiddleware(app, xray_recorder)
-		patch_all()
+	# Behind proxies that set X-Forwarded-For, take the client address from
+	# the given number of trusted hops, the rate limiter keys on it
+	trusted_proxies = int(os.environ.get("TRUSTED_PROXY_COUNT", 0))
+	if trusted_proxies > 0:
+		app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
+
+	# Tracing
+	# Samples requests per route and sends them to the exporter named by
+	# TRACING_EXPORTER, the X-Ray daemon by default outside of development
+	tracing.init_app(app)
 
 	# Add a blueprint for the customers module
 	app.register_blueprint(customer_module)
+
+	# Build the rate limiter now, a misconfigured backend fails the start
+	# instead of every request
+	rate_limiter.get_limiter()
+
+	# Write-behind buffering of customer updates, replays the journal of
+	# a previous run before the app serves and flushes what is left on exit.
+	# start_workers is False in a process that will not serve requests,
+	# e.g. the reloader's parent, which must not take the journal.
+	if start_workers and write_behind.get_buffer() is None:
+		buffer = write_behind.create_buffer(customer_table_client.flush_update)
+		if buffer is not None:
+			write_behind.configure(buffer)
+			atexit.register(buffer.close)
+			if threading.current_thread() is threading.main_thread():
+				signal.signal(signal.SIGTERM, _exit_on_sigterm)
+
+	# Runs before the server starts listening, so the readiness probe only
+	# passes once the clients are warm
+	if os.environ.get("WARM_UP_ON_STARTUP", "false").lower() == 'true':
+		warm_up()
 	
-	return app
\ No newline at end of file
+	return app
@@ -1,7 +1,13 @@
+import os
 from __init__ import create_app
 
+# With the reloader this file also runs in a parent process that only
+# watches for changes, it must not start the background workers
+use_reloader = os.environ.get("FLASK_ENV") == 'development'
+is_reloader_parent = use_reloader and os.environ.get("WERKZEUG_RUN_MAIN") != 'true'
+
 # Call the create app method
-app = create_app()
+app = create_app(start_workers=not is_reloader_parent)
 
 # Run the application
-app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=use_reloader)
\ No newline at end of file
@@ -1,4 +1,4 @@
-import uuid
+import math
 from flask import Blueprint
 from flask import Flask, json, Response, request, abort
 from flask import jsonify, make_response
@@ -7,10 +7,12 @@ from flask import jsonify, make_response
 if __package__ is None or __package__ == '':
     # uses current directory visibility
     import customer_table_client
+    import rate_limiter
     from custom_logger import setup_logger
 else:
     # uses current package visibility
     from flaskr import customer_table_client
+    from flaskr import rate_limiter
     from flaskr.custom_logger import setup_logger
 
 # Set up the custom logger and the Blueprint
@@ -19,16 +21,28 @@ customer_module = Blueprint('customers', __name__)
 
 logger.info("Intialized customer routes")
 
+# Rate limit every request by API key or IP, see rate_limiter.ROUTE_COSTS
+@customer_module.before_request
+def rate_limit():
+    retry_after = rate_limiter.check_request(request)
+    if retry_after is not None:
+        errorResponse = json.dumps({'error': 'Too many requests'})
+        resp = Response(errorResponse, 429)
+        resp.headers["Content-Type"] = "application/json"
+        resp.headers["Retry-After"] = str(int(math.ceil(retry_after)))
+        return resp
+
 # Allow the default route to return a health check
 @customer_module.route('/')
 def health_check():
     return "This a health check. Customer Management Service is up and running."
 
-# Get all customers
+# Get all customers, ?fields=customerId,firstName returns only those attributes
 @customer_module.route('/customers')
 def get_all_customers():
     try:
-        service_response = customer_table_client.get_all_customers()
+        fields = customer_table_client.parse_fields(request.args.get('fields'))
+        service_response = customer_table_client.get_all_customers(fields)
     except Exception as e:
         logger.error(e)
         abort(400)
@@ -36,11 +50,12 @@ def get_all_customers():
     resp.headers["Content-Type"] = "application/json"
     return resp
 
-# Get customer by customerId
+# Get customer by customerId, also accepts ?fields=
 @customer_module.route("/customers/<string:customerId>", methods=['GET'])
 def get_customer(customerId):
     try:
-        service_response = customer_table_client.get_customer(customerId)
+        fields = customer_table_client.parse_fields(request.args.get('fields'))
+        service_response = customer_table_client.get_customer(customerId, fields)
     except Exception as e:
         logger.error(e)
         if 'CustomerNotFound' in e.args:
@@ -1,16 +1,9 @@
 import os
-import boto3
 import json
 import logging
 from collections import defaultdict
-import argparse
-import uuid
 
 import datetime
-from datetime import date
-
-from boto3.dynamodb.conditions import Key, Attr
-from botocore.exceptions import ClientError
 
 S3_BUCKET_URL = os.environ.get("S3_BUCKET_URL")
 S3_BUCKET_NAME = os.environ.get("S3_BUCKET_NAME")
@@ -19,73 +12,69 @@ UPLOAD_FOLDER = "uploads"
 if __package__ is None or __package__ == '':
 	# uses current directory visibility
 	from custom_logger import setup_logger
-	from db import get_db_resource
+	from db import get_db_resource, get_s3_resource
+	import tracing
+	import write_behind
 else:
 	# uses current package visibility
 	from flaskr.custom_logger import setup_logger
-	from flaskr.db import get_db_resource
+	from flaskr.db import get_db_resource, get_s3_resource
+	from flaskr import tracing
+	from flaskr import write_behind
 
 logger = setup_logger(__name__)
 table_name = 'customers'
 
-def get_all_customers():
-	dynamodb = get_db_resource()
-	table = dynamodb.Table(table_name)
-	response = table.scan(
-			Select='ALL_ATTRIBUTES'
-	)
-	customer_list = defaultdict(list)
-
-	for item in response["Items"]:
-		# if 'address' in item.keys():
-		address = {}
-		value = item.get('address')
-		if bool(value):
-			address = {
-				'address_1' : item['address']['address_1'],
-				'address_2' : item['address']['address_2'],
-				'city' : item['address']['city'],
-				'state' : item['address']['state'],
-				'country' : item['address']['country'],
-				'zipcode' : item['address']['zipcode'],
-			}
-
-		customer = {
-			'customerId': item['customerId'],
-			'firstName': item['firstName'],
-			'lastName': item['lastName'],
-			'email': item['email'],
-			'userName': item['userName'],
-			'birthDate': item['birthDate'],
-			'gender': item['gender'],
-			'phoneNumber': item['phoneNumber'],
-			'createdDate': item['createdDate'],
-			'updatedDate': item['updatedDate'],
-			'profilePhotoUrl': item['profilePhotoUrl'],
-			'address': address
-		}
-		customer_list["customers"].append(customer)
-	return json.dumps(customer_list)
-
-def get_customer(customerId):
-	dynamodb = get_db_resource()
-	table = dynamodb.Table(table_name)
-	response = table.get_item(
-		Key={
-			'customerId': customerId
-		},
-		ConsistentRead=True
-	)
-	# logger.info("Logger Response: ")
-	# logger.info(response)
-	if 'Item' not in response:
-		raise Exception("CustomerNotFound")
-
-	item = response['Item']
+# Attributes that can be requested with ?fields=
+CUSTOMER_FIELDS = (
+	'customerId',
+	'firstName',
+	'lastName',
+	'email',
+	'userName',
+	'birthDate',
+	'gender',
+	'phoneNumber',
+	'createdDate',
+	'updatedDate',
+	'profilePhotoUrl',
+	'address',
+)
+
+def parse_fields(value):
+	"""
+	Parses a comma separated ?fields= value into a list of attribute names,
+	None meaning all attributes. Raises InvalidFields for unknown names.
+	"""
+	if not value:
+		return None
+	fields = []
+	for field in value.split(','):
+		field = field.strip()
+		if field and field not in fields:
+			fields.append(field)
+	if not fields:
+		return None
+	if any(field not in CUSTOMER_FIELDS for field in fields):
+		raise Exception('InvalidFields')
+	return fields
+
+def _projection(fields):
+	"""
+	Builds the ProjectionExpression for the requested fields. The key is
+	always read so a missing customer can be told apart from an empty
+	projection, and every name is aliased since some are reserved words.
+	"""
+	names = ['customerId'] + [field for field in fields if field != 'customerId']
+	aliases = {'#p%d' % i: name for i, name in enumerate(names)}
+	return {
+		'ProjectionExpression': ', '.join(aliases),
+		'ExpressionAttributeNames': aliases
+	}
 
+def _serialize_address(item):
 	address = {}
 	value = item.get('address')
-	
 	if bool(value):
 		address = {
 			'address_1' : item['address']['address_1'],
@@ -95,8 +84,20 @@ def get_customer(customerId):
 			'country' : item['address']['country'],
 			'zipcode' : item['address']['zipcode'],
 		}
-
-	customer = {
+	return address
+
+def _serialize_customer(item, fields=None):
+	if fields is not None:
+		# Sparse response, only the requested fields that the item has
+		customer = {}
+		for field in fields:
+			if field == 'address':
+				customer['address'] = _serialize_address(item)
+			elif field in item:
+				customer[field] = item[field]
+		return customer
+
+	return {
 		'customerId': item['customerId'],
 		'firstName': item['firstName'],
 		'lastName': item['lastName'],
@@ -108,8 +109,67 @@ def get_customer(customerId):
 		'createdDate': item['createdDate'],
 		'updatedDate': item['updatedDate'],
 		'profilePhotoUrl': item['profilePhotoUrl'],
-		'address': address
+		'address': _serialize_address(item)
 	}
+
+def _with_pending(buffer, item):
+	"""Overlays the updates still in the write-behind buffer on a stored item"""
+	pending = buffer.pending(item['customerId'])
+	if pending is None:
+		return item
+	return dict(item, **pending)
+
+def get_all_customers(fields=None):
+	dynamodb = get_db_resource()
+	table = dynamodb.Table(table_name)
+	if fields is None:
+		scan_args = {'Select': 'ALL_ATTRIBUTES'}
+	else:
+		scan_args = dict(_projection(fields), Select='SPECIFIC_ATTRIBUTES')
+	with tracing.span('dynamodb.scan', table=table_name) as span:
+		response = table.scan(
+				ReturnConsumedCapacity='TOTAL',
+				**scan_args
+		)
+		span.record_dynamodb(response)
+	customer_list = defaultdict(list)
+
+	buffer = write_behind.get_buffer()
+	for item in response["Items"]:
+		if buffer is not None:
+			if fields is None:
+				buffer.recent.remember(item)
+			item = _with_pending(buffer, item)
+		customer_list["customers"].append(_serialize_customer(item, fields))
+	return json.dumps(customer_list)
+
+def get_customer(customerId, fields=None):
+	dynamodb = get_db_resource()
+	table = dynamodb.Table(table_name)
+	get_args = {} if fields is None else _projection(fields)
+	with tracing.span('dynamodb.get_item', table=table_name) as span:
+		response = table.get_item(
+			Key={
+				'customerId': customerId
+			},
+			ConsistentRead=True,
+			ReturnConsumedCapacity='TOTAL',
+			**get_args
+		)
+		span.record_dynamodb(response)
+	# logger.info("Logger Response: ")
+	# logger.info(response)
+	if 'Item' not in response:
+		raise Exception("CustomerNotFound")
+
+	item = response['Item']
+	buffer = write_behind.get_buffer()
+	if buffer is not None:
+		if fields is None:
+			buffer.recent.remember(item)
+		item = _with_pending(buffer, item)
+
+	customer = _serialize_customer(item, fields)
 	return json.dumps({'customer': customer})
 
 def create_customer(customer_dict):
@@ -130,22 +190,25 @@ def create_customer(customer_dict):
 	if unique:
 		dynamodb = get_db_resource()
 		table = dynamodb.Table(table_name)
-		response = table.put_item(
-			TableName=table_name,
-			Item={
-					'customerId': customerId,
-					'firstName':  firstName,
-					'lastName': lastName,
-					'email': email,
-					'userName': userName,
-					'birthDate': birthDate,
-					'gender': gender,
-					'phoneNumber': phoneNumber,
-					'createdDate': createdDate,
-					'updatedDate': updatedDate,
-					'profilePhotoUrl': profilePhotoUrl
-				}
-			)
+		with tracing.span('dynamodb.put_item', table=table_name) as span:
+			response = table.put_item(
+				TableName=table_name,
+				Item={
+						'customerId': customerId,
+						'firstName':  firstName,
+						'lastName': lastName,
+						'email': email,
+						'userName': userName,
+						'birthDate': birthDate,
+						'gender': gender,
+						'phoneNumber': phoneNumber,
+						'createdDate': createdDate,
+						'updatedDate': updatedDate,
+						'profilePhotoUrl': profilePhotoUrl
+					},
+				ReturnConsumedCapacity='TOTAL'
+				)
+			span.record_dynamodb(response)
 		# logger.info("Logger Response: ")
 		# logger.info(response)
 		customer = {
@@ -161,10 +224,56 @@ def create_customer(customer_dict):
 			'updatedDate': updatedDate,
 			'profilePhotoUrl': profilePhotoUrl,
 		}
+		buffer = write_behind.get_buffer()
+		if buffer is not None:
+			buffer.recent.remember(customer)
 		return json.dumps({'customer': customer})
 	else: 
 		raise Exception('CustomerExists')
 
+def _update_args(attributes):
+	"""Builds the UpdateExpression setting every given attribute"""
+	names = {}
+	values = {}
+	assignments = []
+	for i, (name, value) in enumerate(attributes.items()):
+		names['#a%d' % i] = name
+		values[':v%d' % i] = value
+		assignments.append('#a%d = :v%d' % (i, i))
+	return {
+		'UpdateExpression': 'set ' + ', '.join(assignments),
+		'ExpressionAttributeNames': names,
+		'ExpressionAttributeValues': values
+	}
+
+def flush_update(customerId, attributes):
+	"""
+	Writes a coalesced update from the write-behind buffer. Customers that
+	no longer exist are skipped rather than recreated from a partial item.
+	"""
+	from botocore.exceptions import ClientError
+
+	dynamodb = get_db_resource()
+	table = dynamodb.Table(table_name)
+	try:
+		with tracing.span('dynamodb.update_item', table=table_name, operation='write_behind') as span:
+			response = table.update_item(
+				Key={
+					'customerId': customerId
+				},
+				ConditionExpression='attribute_exists(customerId)',
+				ReturnConsumedCapacity='TOTAL',
+				**_update_args(attributes)
+			)
+			span.record_dynamodb(response)
+	except ClientError as e:
+		code = e.response['Error']['Code']
+		if code in ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded'):
+			raise Exception('Throttled')
+		if code != 'ConditionalCheckFailedException':
+			raise
+		logger.error("Dropping write-behind update for missing customer " + customerId)
+
 def update_customer(customerId, customer_dict):
 	""" logger.info("Customer Dict Response: ")
 	logger.info(customer_dict) """
@@ -184,47 +293,65 @@ def update_customer(customerId, customer_dict):
 	country = str(customer_dict['country'])
 	zipcode = str(customer_dict['zipCode'])
 
+	attributes = {
+		'firstName': firstName,
+		'lastName': lastName,
+		'email': email,
+		'userName': userName,
+		'birthDate': birthDate,
+		'gender': gender,
+		'phoneNumber': phoneNumber,
+		'updatedDate': updatedDate,
+		'profilePhotoUrl': profilePhotoUrl,
+		'address': {
+			'address_1': address_1,
+			'address_2': address_2,
+			'city': city,
+			'state': state,
+			'country': country,
+			'zipcode': zipcode
+		}
+	}
+
 	dynamodb = get_db_resource()
 	table = dynamodb.Table(table_name)
+
+	# In write-behind mode the update is journaled and written later. Both
+	# modes answer the same way: CustomerNotFound for a missing customer,
+	# otherwise the whole item as it will be after the update. The item is
+	# usually known from the read that came before the update, else it is
+	# read eventually consistent, half the cost of a consistent read.
+	buffer = write_behind.get_buffer()
+	if buffer is not None:
+		item = buffer.recent.get(customerId)
+		if item is None:
+			with tracing.span('dynamodb.get_item', table=table_name, operation='write_behind') as span:
+				response = table.get_item(
+					Key={
+						'customerId': customerId
+					},
+					ReturnConsumedCapacity='TOTAL'
+				)
+				span.record_dynamodb(response)
+			if 'Item' not in response:
+				raise Exception("CustomerNotFound")
+			item = response['Item']
+			buffer.recent.remember(item)
+		pending = buffer.submit(customerId, attributes)
+		return json.dumps({'customer': dict(item, **pending)})
 	
 	try:
-		response = table.update_item(
-			Key={
-				'customerId': customerId
-			},
-			UpdateExpression="""set firstName = :p_firstName,
-								lastName = :p_lastName,
-								email = :p_email,
-								userName = :p_userName,
-								birthDate = :p_birthDate,
-								gender = :p_gender,
-								phoneNumber = :p_phoneNumber,
-								updatedDate = :p_updatedDate,
-								profilePhotoUrl = :p_profilePhotoUrl, #attrName = :attrValue""",
-			ExpressionAttributeNames = {
-				"#attrName" : "address"
-			},
-			ExpressionAttributeValues = {
-				':p_firstName': firstName,
-				':p_lastName' : lastName,
-				':p_email':  email,
-				':p_userName': userName,
-				':p_birthDate': birthDate,
-				':p_gender':  gender,
-				':p_phoneNumber': phoneNumber,
-				':p_updatedDate':  updatedDate,
-				':p_profilePhotoUrl':  profilePhotoUrl,
-				':attrValue': {
-					'address_1': address_1,
-					'address_2': address_2,
-					'city': city,
-					'state': state,
-					'country': country,
-					'zipcode': zipcode
-				}
-			},
-			ReturnValues="ALL_NEW"
-		)  
+		with tracing.span('dynamodb.update_item', table=table_name) as span:
+			response = table.update_item(
+				Key={
+					'customerId': customerId
+				},
+				ConditionExpression='attribute_exists(customerId)',
+				ReturnValues="ALL_NEW",
+				ReturnConsumedCapacity='TOTAL',
+				**_update_args(attributes)
+			)
+			span.record_dynamodb(response)
 
 	except Exception as e:
 		raise Exception("CustomerNotFound")
@@ -251,19 +378,28 @@ def update_customer(customerId, customer_dict):
 	return json.dumps({'customer': updated_customer})
 
 def delete_customer(customerId):
+	buffer = write_behind.get_buffer()
+	if buffer is not None:
+		buffer.discard(customerId)
+
 	dynamodb = get_db_resource()
 	table = dynamodb.Table(table_name)
-	response = table.delete_item(
-		TableName=table_name,
-		Key={
-			'customerId': customerId
-		}
-	)
+	with tracing.span('dynamodb.delete_item', table=table_name) as span:
+		response = table.delete_item(
+			TableName=table_name,
+			Key={
+				'customerId': customerId
+			},
+			ReturnValues='ALL_OLD',
+			ReturnConsumedCapacity='TOTAL'
+		)
+		span.record_dynamodb(response)
 
 	logger.info("Logger Response: ")
 	logger.info(response)
 
-	if 'ConsumedCapacity' in response:
+	# ALL_OLD only returns Attributes when there was an item to delete
+	if not response.get('Attributes'):
 		raise Exception("CustomerNotFound")
 
 	customer = {
@@ -276,6 +412,8 @@ def is_unique(customerId, email, userName):
 	Checks if email, userName, custNumber, cardNumber are unique
 	Will return a list do duplicate fields
 	"""
+	from boto3.dynamodb.conditions import Attr
+
 	dynamodb = get_db_resource()
 
 	table = dynamodb.Table(table_name)
@@ -284,11 +422,14 @@ def is_unique(customerId, email, userName):
 		| Attr('email').eq(email) \
 		| Attr('userName').eq(userName)
 
-	response = table.scan(
-		Select='ALL_ATTRIBUTES',
-		FilterExpression=filter_expression,
-		ConsistentRead=True,
-	)
+	with tracing.span('dynamodb.scan', table=table_name, operation='is_unique') as span:
+		response = table.scan(
+			Select='ALL_ATTRIBUTES',
+			FilterExpression=filter_expression,
+			ConsistentRead=True,
+			ReturnConsumedCapacity='TOTAL'
+		)
+		span.record_dynamodb(response)
 	return len(response['Items']) == 0 
 
 def get_max_value(attribute):
@@ -338,24 +479,31 @@ def customer_number_generator():
 	return new_card_number """
 
 def get_all_images():
-	s3 = boto3.resource('s3')
+	s3 = get_s3_resource()
 	my_bucket = s3.Bucket('react-customer-images')
 
 	# Output the bucket names
 	bucket_list = defaultdict(list)
-	for my_bucket_object in my_bucket.objects.all():
-		item = {
-			"name": 'https://' + S3_BUCKET_NAME + '.' + S3_BUCKET_URL + '/' + my_bucket_object.key
-		}
-		bucket_list["items"].append(item)
+	with tracing.span('s3.list_objects', bucket=my_bucket.name) as span:
+		for my_bucket_object in my_bucket.objects.all():
+			item = {
+				"name": 'https://' + S3_BUCKET_NAME + '.' + S3_BUCKET_URL + '/' + my_bucket_object.key
+			}
+			bucket_list["items"].append(item)
+		span.set('item_count', len(bucket_list["items"]))
 
 	return json.dumps(bucket_list)
 
 def upload_to_aws(file):
+	from botocore.exceptions import ClientError
+
 	try:
-		s3_resource = boto3.resource('s3')
+		s3_resource = get_s3_resource()
 		bucket = s3_resource.Bucket(S3_BUCKET_NAME)
-		response = bucket.Object(file.filename).put(Body=file.read());
+		with tracing.span('s3.put_object', bucket=S3_BUCKET_NAME) as span:
+			body = file.read()
+			span.set('bytes', len(body))
+			response = bucket.Object(file.filename).put(Body=body);
 	except ClientError as e:
 		logging.error(e)
 		return False
@@ -22,9 +22,21 @@ def get_db_resource():
 		)
 
 	return dynamodb """
-import boto3
 import os
-def get_db_resource():
+import threading
+
+# boto3 is imported lazily inside the factories below, loading it (and the
+# botocore service models) is the single most expensive part of a cold start.
+#
+# Each service has one low-level client, created once and shared by every
+# thread since clients are thread-safe, along with its connection pool.
+# Resources are not thread-safe, so callers get a new one per call, a thin
+# wrapper around the shared client that costs a fraction of a millisecond.
+_base_resources = {}
+_resources_lock = threading.Lock()
+
+def _create_db_resource():
+	import boto3
 	# check environment as long as its not development
 	if os.environ.get("FLASK_ENV") != 'development':
 		dynamodb = boto3.resource('dynamodb',
@@ -36,4 +48,48 @@ def get_db_resource():
   		aws_access_key_id='x',
 			aws_secret_access_key='x'
 		)
-	return dynamodb
\ No newline at end of file
+	return dynamodb
+
+def _create_s3_resource():
+	import boto3
+	return boto3.resource('s3')
+
+def _get_base_resource(name, factory):
+	"""Returns the resource holding the shared client, creating it on first use"""
+	resource = _base_resources.get(name)
+	if resource is None:
+		with _resources_lock:
+			resource = _base_resources.get(name)
+			if resource is None:
+				resource = factory()
+				_base_resources[name] = resource
+	return resource
+
+def _get_resource(name, factory):
+	base = _get_base_resource(name, factory)
+	return type(base)(client=base.meta.client)
+
+def get_db_client():
+	return _get_base_resource('dynamodb', _create_db_resource).meta.client
+
+def get_db_resource():
+	return _get_resource('dynamodb', _create_db_resource)
+
+def get_s3_resource():
+	return _get_resource('s3', _create_s3_resource)
+
+def reset_resources():
+	"""Drops the shared clients, the next call creates fresh ones"""
+	with _resources_lock:
+		_base_resources.clear()
+
+def warm_up(table_name='customers'):
+	"""
+	Creates the shared AWS clients ahead of the first request, so the
+	import, service model loading, credential lookup and the TLS handshake
+	of the DynamoDB connection are paid for before the pod reports ready.
+	Request threads reuse the clients and the open connection.
+	"""
+	_get_base_resource('s3', _create_s3_resource)
+	# describe_table is free (no capacity consumed) and opens the connection
+	get_db_client().describe_table(TableName=table_name)
@@ -0,0 +1,181 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+if __package__ is None or __package__ == '':
+	# uses current directory visibility
+	from custom_logger import setup_logger
+else:
+	# uses current package visibility
+	from flaskr.custom_logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Tokens taken per request, by endpoint. Scans read the whole table so they
+# cost far more than point reads, create_customer scans in is_unique.
+ROUTE_COSTS = {
+	'customers.health_check': 0,
+	'customers.get_all_customers': 10,
+	'customers.get_customer': 1,
+	'customers.create_customer': 10,
+	'customers.update_customer': 1,
+	'customers.delete_customer': 1,
+	'customers.get_all_images': 5,
+	'customers.upload_to_aws': 2,
+}
+DEFAULT_COST = 1
+
+class MemoryBackend:
+	"""
+	Token buckets held in this process, limits apply per replica. At most
+	max_keys buckets are kept, the least recently used is evicted first.
+	"""
+	def __init__(self, clock=time.monotonic, max_keys=10000):
+		self.clock = clock
+		self.max_keys = max_keys
+		self._buckets = OrderedDict()
+		self._lock = threading.Lock()
+
+	def consume(self, key, cost, capacity, refill_rate):
+		"""Returns 0 if the tokens were taken, otherwise the seconds until they will be"""
+		with self._lock:
+			now = self.clock()
+			tokens, updated = self._buckets.pop(key, (capacity, now))
+			tokens = min(capacity, tokens + (now - updated) * refill_rate)
+			retry_after = 0
+			if tokens >= cost:
+				tokens -= cost
+			else:
+				retry_after = (cost - tokens) / refill_rate
+			self._buckets[key] = (tokens, now)
+			if len(self._buckets) > self.max_keys:
+				self._buckets.popitem(last=False)
+			return retry_after
+
+class RedisBackend:
+	"""Token buckets shared by every replica, updated atomically in a Lua script"""
+	SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * refill_rate)
+local retry_after = 0
+if tokens >= cost then
+	tokens = tokens - cost
+else
+	retry_after = (cost - tokens) / refill_rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / refill_rate) + 1)
+return tostring(retry_after)
+"""
+
+	def __init__(self, url, prefix='rate-limit:customers:'):
+		# redis is only needed when the shared backend is used
+		import redis
+
+		self.prefix = prefix
+		self._client = redis.Redis.from_url(url)
+		self._script = self._client.register_script(self.SCRIPT)
+
+	def consume(self, key, cost, capacity, refill_rate):
+		retry_after = self._script(keys=[self.prefix + key], args=[capacity, refill_rate, cost])
+		return float(retry_after)
+
+def _digest(api_key):
+	return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+class RateLimiter:
+	def __init__(self, backend, capacity, refill_rate, costs=None, api_keys=()):
+		self.backend = backend
+		self.capacity = capacity
+		self.refill_rate = refill_rate
+		self.costs = ROUTE_COSTS if costs is None else costs
+		# Only digests are kept, the keys themselves never leave the environment
+		self.api_keys = frozenset(_digest(api_key) for api_key in api_keys)
+
+	def client_key(self, request):
+		"""
+		Identifies the caller by API key when it is one of the configured
+		keys, otherwise by IP address. Unknown keys are ignored, else a
+		client could get a fresh bucket by sending a new key every time.
+		"""
+		api_key = request.headers.get('X-Api-Key')
+		if api_key:
+			digest = _digest(api_key)
+			if digest in self.api_keys:
+				return 'key:' + digest
+		return 'ip:' + str(request.remote_addr)
+
+	def check(self, key, endpoint):
+		"""
+		Takes the endpoint's cost from the caller's bucket. Returns None if
+		the request may proceed, otherwise the seconds to wait before retrying.
+		"""
+		cost = min(self.costs.get(endpoint, DEFAULT_COST), self.capacity)
+		if cost <= 0:
+			return None
+		try:
+			retry_after = self.backend.consume(key, cost, self.capacity, self.refill_rate)
+		except Exception as e:
+			# Fail open, an unavailable backend must not take the service down
+			logger.error(e)
+			return None
+		return retry_after if retry_after > 0 else None
+
+def create_limiter():
+	"""Builds the limiter from the RATE_LIMIT_* environment, None when disabled"""
+	if os.environ.get("RATE_LIMIT_ENABLED", "false").lower() != 'true':
+		return None
+	if os.environ.get("RATE_LIMIT_BACKEND", "memory").lower() == 'redis':
+		backend = RedisBackend(os.environ.get("RATE_LIMIT_REDIS_URL", 'redis://localhost:6379/0'))
+	else:
+		backend = MemoryBackend()
+	api_keys = os.environ.get("RATE_LIMIT_API_KEYS", "")
+	return RateLimiter(
+		backend,
+		float(os.environ.get("RATE_LIMIT_CAPACITY", 60)),
+		float(os.environ.get("RATE_LIMIT_REFILL_RATE", 10)),
+		api_keys=[api_key.strip() for api_key in api_keys.split(',') if api_key.strip()]
+	)
+
+_limiter = None
+_configured = False
+_configure_lock = threading.Lock()
+
+def configure(limiter):
+	"""Replaces the limiter built from the environment, None disables limiting"""
+	global _limiter, _configured
+	with _configure_lock:
+		_limiter = limiter
+		_configured = True
+
+def reset():
+	"""Forgets the limiter, the next get_limiter() builds it from the environment"""
+	global _limiter, _configured
+	with _configure_lock:
+		_limiter = None
+		_configured = False
+
+def get_limiter():
+	global _limiter, _configured
+	if not _configured:
+		with _configure_lock:
+			if not _configured:
+				_limiter = create_limiter()
+				_configured = True
+	return _limiter
+
+def check_request(request):
+	"""Returns None if the request may proceed, otherwise the seconds to wait"""
+	limiter = get_limiter()
+	if limiter is None:
+		return None
+	return limiter.check(limiter.client_key(request), request.endpoint)
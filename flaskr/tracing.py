@@ -0,0 +1,380 @@
+import os
+import json
+import random
+import socket
+import threading
+import time
+import binascii
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context
+
+if __package__ is None or __package__ == '':
+	# uses current directory visibility
+	from custom_logger import setup_logger
+else:
+	# uses current package visibility
+	from flaskr.custom_logger import setup_logger
+
+logger = setup_logger(__name__)
+
+SERVICE_NAME = 'myproject-customer-service'
+DEFAULT_SAMPLE_RATE = 0.05
+
+def _random_hex(length):
+	return binascii.hexlify(os.urandom(length // 2)).decode('ascii')
+
+def new_trace_id():
+	"""32 hex characters, the first 8 being the epoch, valid for both X-Ray and OTLP"""
+	return '%08x' % int(time.time()) + _random_hex(24)
+
+def parse_route_rates(value):
+	"""
+	Parses TRACING_ROUTE_SAMPLE_RATES, a comma separated list of
+	<url rule>=<rate>, e.g. "/customers=0.01,/customers/<string:customerId>=0.1"
+	"""
+	rates = {}
+	for entry in (value or '').split(','):
+		entry = entry.strip()
+		if not entry:
+			continue
+		rule, _, rate = entry.rpartition('=')
+		rates[rule.strip()] = float(rate)
+	return rates
+
+class Sampler:
+	"""Decides per request whether it is traced, using a rate per url rule"""
+	def __init__(self, default_rate=DEFAULT_SAMPLE_RATE, route_rates=None):
+		self.default_rate = default_rate
+		self.route_rates = route_rates or {}
+
+	def rate_for(self, rule):
+		return self.route_rates.get(rule, self.default_rate)
+
+	def should_sample(self, rule):
+		rate = self.rate_for(rule)
+		return rate > 0 and random.random() < rate
+
+class Span:
+	def __init__(self, trace, name, parent_id=None, attributes=None):
+		self.trace = trace
+		self.name = name
+		self.span_id = _random_hex(16)
+		self.parent_id = parent_id
+		self.attributes = dict(attributes or {})
+		self.error = None
+		self.start_time = time.time()
+		self.end_time = None
+
+	def set(self, key, value):
+		self.attributes[key] = value
+
+	def record_dynamodb(self, response):
+		"""Records the item count and consumed capacity of a DynamoDB response"""
+		if 'Count' in response:
+			self.set('item_count', response['Count'])
+		elif 'Items' in response:
+			self.set('item_count', len(response['Items']))
+		else:
+			self.set('item_count', 1 if 'Item' in response or 'Attributes' in response else 0)
+		consumed = response.get('ConsumedCapacity')
+		if consumed:
+			self.set('consumed_capacity', float(consumed.get('CapacityUnits', 0)))
+
+	def finish(self):
+		self.end_time = time.time()
+
+	def to_dict(self):
+		return {
+			'trace_id': self.trace.trace_id,
+			'span_id': self.span_id,
+			'parent_id': self.parent_id,
+			'name': self.name,
+			'start_time': self.start_time,
+			'end_time': self.end_time,
+			'attributes': self.attributes,
+			'error': self.error,
+		}
+
+class _NullSpan:
+	"""Returned when the request is not sampled, every call is a no-op"""
+	def set(self, key, value):
+		pass
+
+	def record_dynamodb(self, response):
+		pass
+
+NULL_SPAN = _NullSpan()
+
+class Trace:
+	"""The spans of one sampled request, the root span being the request itself"""
+	def __init__(self, name, trace_id=None, parent_id=None, attributes=None):
+		self.trace_id = trace_id or new_trace_id()
+		self.root = Span(self, name, parent_id, attributes)
+		self.spans = []
+
+	def start_span(self, name, attributes=None):
+		span = Span(self, name, self.root.span_id, attributes)
+		self.spans.append(span)
+		return span
+
+class FileExporter:
+	"""Appends one JSON line per trace, a local stand-in for a collector"""
+	def __init__(self, path):
+		self.path = path
+		self._lock = threading.Lock()
+
+	def export(self, trace):
+		line = json.dumps({
+			'service': SERVICE_NAME,
+			'spans': [trace.root.to_dict()] + [s.to_dict() for s in trace.spans]
+		})
+		with self._lock:
+			with open(self.path, 'a') as f:
+				f.write(line + '\n')
+
+class XRayDaemonExporter:
+	"""Sends segment documents to the X-Ray daemon over UDP"""
+	HEADER = '{"format": "json", "version": 1}\n'
+
+	def __init__(self, address):
+		host, _, port = address.rpartition(':')
+		self.host = host or '127.0.0.1'
+		self.port = int(port)
+		self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.address = None
+		try:
+			self._resolve()
+		except OSError as e:
+			# Retried on the first export, the daemon may not be up yet
+			logger.error(e)
+
+	def _resolve(self):
+		"""Looks the daemon up once, sendto with a hostname would do it on every trace"""
+		info = socket.getaddrinfo(self.host, self.port, socket.AF_INET, socket.SOCK_DGRAM)
+		self.address = info[0][4]
+
+	def segment(self, trace):
+		root = trace.root
+		segment = {
+			'name': SERVICE_NAME,
+			'id': root.span_id,
+			'trace_id': '1-%s-%s' % (trace.trace_id[:8], trace.trace_id[8:]),
+			'start_time': root.start_time,
+			'end_time': root.end_time,
+			'http': {
+				'request': {
+					'method': root.attributes.get('http.method'),
+					'url': root.attributes.get('http.url'),
+				},
+				'response': {'status': root.attributes.get('http.status_code')},
+			},
+			'subsegments': [{
+				'id': s.span_id,
+				'name': s.name,
+				'start_time': s.start_time,
+				'end_time': s.end_time,
+				'namespace': 'aws',
+				'metadata': {'default': s.attributes},
+				'fault': s.error is not None,
+			} for s in trace.spans],
+		}
+		if root.parent_id:
+			segment['parent_id'] = root.parent_id
+		if root.error:
+			segment['fault'] = True
+		return segment
+
+	def export(self, trace):
+		document = (self.HEADER + json.dumps(self.segment(trace))).encode('utf-8')
+		if self.address is None:
+			self._resolve()
+		try:
+			self._socket.sendto(document, self.address)
+		except OSError:
+			# The daemon may have moved, e.g. a new service IP
+			self._resolve()
+			self._socket.sendto(document, self.address)
+
+class OtlpExporter:
+	"""
+	Posts traces to an OTLP/HTTP collector as JSON. Requests are sent from a
+	background thread so the collector never adds latency to the response.
+	"""
+	def __init__(self, endpoint, max_queue=1000):
+		import queue
+
+		self.url = endpoint.rstrip('/') + '/v1/traces'
+		self._queue = queue.Queue(max_queue)
+		self._worker = threading.Thread(target=self._run, name='otlp-exporter', daemon=True)
+		self._worker.start()
+
+	@staticmethod
+	def _attributes(attributes):
+		values = []
+		for key, value in attributes.items():
+			if isinstance(value, bool):
+				typed = {'boolValue': value}
+			elif isinstance(value, int):
+				typed = {'intValue': str(value)}
+			elif isinstance(value, float):
+				typed = {'doubleValue': value}
+			else:
+				typed = {'stringValue': str(value)}
+			values.append({'key': key, 'value': typed})
+		return values
+
+	def payload(self, trace):
+		spans = []
+		for span in [trace.root] + trace.spans:
+			otlp_span = {
+				'traceId': trace.trace_id,
+				'spanId': span.span_id,
+				'name': span.name,
+				'kind': 2 if span is trace.root else 3,
+				'startTimeUnixNano': str(int(span.start_time * 1e9)),
+				'endTimeUnixNano': str(int(span.end_time * 1e9)),
+				'attributes': self._attributes(span.attributes),
+				'status': {'code': 2 if span.error else 1},
+			}
+			if span.parent_id:
+				otlp_span['parentSpanId'] = span.parent_id
+			spans.append(otlp_span)
+		return {
+			'resourceSpans': [{
+				'resource': {'attributes': self._attributes({'service.name': SERVICE_NAME})},
+				'scopeSpans': [{'scope': {'name': __name__}, 'spans': spans}],
+			}]
+		}
+
+	def export(self, trace):
+		try:
+			self._queue.put_nowait(self.payload(trace))
+		except Exception:
+			logger.error("OTLP export queue is full, dropping trace")
+
+	def _run(self):
+		from urllib.request import Request, urlopen
+
+		while True:
+			payload = self._queue.get()
+			try:
+				req = Request(self.url, data=json.dumps(payload).encode('utf-8'),
+					headers={'Content-Type': 'application/json'})
+				urlopen(req, timeout=5).close()
+			except Exception as e:
+				logger.error(e)
+
+def create_exporter(name=None):
+	"""Builds the exporter named by TRACING_EXPORTER: xray, otlp, file or none"""
+	if name is None:
+		default = 'none' if os.environ.get("FLASK_ENV") == 'development' else 'xray'
+		name = os.environ.get("TRACING_EXPORTER", default)
+	name = name.lower()
+	if name == 'xray':
+		return XRayDaemonExporter(os.environ.get("AWS_XRAY_DAEMON_ADDRESS", '127.0.0.1:2000'))
+	if name == 'otlp':
+		return OtlpExporter(os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", 'http://localhost:4318'))
+	if name == 'file':
+		return FileExporter(os.environ.get("TRACING_FILE_PATH", 'traces.jsonl'))
+	if name == 'none':
+		return None
+	raise ValueError("Unknown tracing exporter: " + name)
+
+def create_sampler():
+	return Sampler(
+		float(os.environ.get("TRACING_SAMPLE_RATE", DEFAULT_SAMPLE_RATE)),
+		parse_route_rates(os.environ.get("TRACING_ROUTE_SAMPLE_RATES"))
+	)
+
+def _parse_amzn_trace_header(value):
+	"""Returns (trace_id, parent_id, sampled) from an X-Amzn-Trace-Id header"""
+	fields = dict(part.split('=', 1) for part in value.split(';') if '=' in part)
+	root = fields.get('Root', '')
+	trace_id = root[2:].replace('-', '') if root.startswith('1-') else None
+	if trace_id is not None and len(trace_id) != 32:
+		trace_id = None
+	sampled = {'1': True, '0': False}.get(fields.get('Sampled'))
+	return trace_id, fields.get('Parent'), sampled
+
+def init_app(app, exporter=None, sampler=None, trust_upstream=None):
+	"""
+	Traces a sample of the app's requests. Nothing is recorded for requests
+	that are not sampled, and nothing at all when there is no exporter.
+
+	The X-Amzn-Trace-Id header is only honoured with trust_upstream
+	(TRACING_TRUST_UPSTREAM=true), i.e. when every request arrives through
+	a proxy that sets it. Otherwise any caller could force its requests to
+	be traced.
+	"""
+	if exporter is None:
+		exporter = create_exporter()
+	if exporter is None:
+		return
+	if sampler is None:
+		sampler = create_sampler()
+	if trust_upstream is None:
+		trust_upstream = os.environ.get("TRACING_TRUST_UPSTREAM", "false").lower() == 'true'
+	app.extensions['tracing'] = exporter
+
+	@app.before_request
+	def start_trace():
+		# Unmatched URLs share one name, else every path probed would be a new route
+		rule = request.url_rule.rule if request.url_rule else '<unmatched>'
+		trace_id, parent_id, sampled = None, None, None
+		if trust_upstream:
+			trace_id, parent_id, sampled = _parse_amzn_trace_header(
+				request.headers.get('X-Amzn-Trace-Id', ''))
+		if sampled is None:
+			sampled = sampler.should_sample(rule)
+		if not sampled:
+			return
+		g.trace = Trace(request.method + ' ' + rule, trace_id, parent_id, {
+			'http.method': request.method,
+			'http.url': request.url,
+			'http.route': rule,
+		})
+
+	@app.after_request
+	def record_status(response):
+		trace = g.get('trace')
+		if trace is not None:
+			trace.root.set('http.status_code', response.status_code)
+		return response
+
+	@app.teardown_request
+	def finish_trace(error=None):
+		trace = g.pop('trace', None)
+		if trace is None:
+			return
+		if error is not None:
+			trace.root.error = repr(error)
+		trace.root.finish()
+		try:
+			exporter.export(trace)
+		except Exception as e:
+			logger.error(e)
+
+def current_trace():
+	if has_request_context():
+		return g.get('trace')
+	return None
+
+@contextmanager
+def span(name, **attributes):
+	"""
+	Times a block within the current request's trace, e.g. one DynamoDB call.
+	Yields a no-op span when the request is not sampled.
+	"""
+	trace = current_trace()
+	if trace is None:
+		yield NULL_SPAN
+		return
+	current = trace.start_span(name, attributes)
+	try:
+		yield current
+	except Exception as e:
+		current.error = repr(e)
+		raise
+	finally:
+		current.finish()
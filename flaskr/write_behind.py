@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import fcntl
+import threading
+from collections import OrderedDict
+
+if __package__ is None or __package__ == '':
+	# uses current directory visibility
+	from custom_logger import setup_logger
+else:
+	# uses current package visibility
+	from flaskr.custom_logger import setup_logger
+
+logger = setup_logger(__name__)
+
+MAX_BACKOFF = 30.0
+
+class RecentItems:
+	"""
+	Stored items read in the last ttl seconds, so an update can be checked
+	against the item without a round trip to the table, e.g. the PUT that
+	follows the GET of a profile form.
+	"""
+	def __init__(self, ttl=60.0, max_items=10000, clock=time.monotonic):
+		self.ttl = ttl
+		self.max_items = max_items
+		self.clock = clock
+		self._items = OrderedDict()
+		self._lock = threading.Lock()
+
+	def remember(self, item):
+		with self._lock:
+			self._items.pop(item['customerId'], None)
+			self._items[item['customerId']] = (self.clock(), item)
+			if len(self._items) > self.max_items:
+				self._items.popitem(last=False)
+
+	def get(self, customerId):
+		with self._lock:
+			entry = self._items.get(customerId)
+			if entry is None:
+				return None
+			if self.clock() - entry[0] > self.ttl:
+				del self._items[customerId]
+				return None
+			return entry[1]
+
+	def forget(self, customerId):
+		with self._lock:
+			self._items.pop(customerId, None)
+
+class WriteBehindBuffer:
+	"""
+	Accepts customer updates into an append-only journal and writes them to
+	the table from a background thread.
+
+	Updates to the same customerId are merged, later values winning, so a
+	burst of edits costs one write. A customer keeps its place in the queue
+	from its first unwritten update, so flushes go oldest first and a
+	customer that keeps being edited is still written in turn.
+
+	Every update is fsynced to the journal before it is acknowledged. Once
+	written to the table an acknowledgement is appended, and the journal is
+	only rewritten every compact_every records. After a crash the updates
+	without an acknowledgement are replayed, which may repeat a write that
+	already happened, safe as updates only set values.
+
+	The worker writes at most max_writes_per_second, and backs off when
+	apply_update raises Exception('Throttled'). The journal is locked for
+	the life of the buffer, a second buffer on the same journal raises
+	Exception('JournalLocked').
+	"""
+	def __init__(self, journal_path, apply_update, flush_interval=1.0, batch_size=25,
+			max_writes_per_second=None, compact_every=1000):
+		self.journal_path = journal_path
+		self.apply_update = apply_update
+		self.flush_interval = flush_interval
+		self.batch_size = batch_size
+		self.max_writes_per_second = max_writes_per_second
+		self.compact_every = compact_every
+		self.recent = RecentItems()
+		# customerId -> (seq, attributes), in the order of the first unwritten update
+		self._pending = OrderedDict()
+		self._seq = 0
+		self._records = 0
+		self._backoff = 0.0
+		self._closed = False
+		self._lock = threading.Lock()
+		self._flush_lock = threading.Lock()
+		self._stop = threading.Event()
+		self._worker = None
+		self._lock_file = self._acquire_journal()
+		self._journal = None
+		self._recover()
+
+	def _acquire_journal(self):
+		# The lock is on a separate file since compaction replaces the journal
+		lock_file = open(self.journal_path + '.lock', 'a')
+		try:
+			fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except OSError:
+			lock_file.close()
+			raise Exception('JournalLocked')
+		return lock_file
+
+	def _recover(self):
+		if os.path.exists(self.journal_path):
+			with open(self.journal_path) as f:
+				for line in f:
+					try:
+						record = json.loads(line)
+					except ValueError:
+						# A write cut short by the crash, it was never acknowledged
+						logger.error("Skipping unreadable journal record")
+						continue
+					self._seq = max(self._seq, record['seq'])
+					self._apply_record(record)
+			if self._pending:
+				logger.info("Recovered %d pending updates" % len(self._pending))
+		self._compact()
+
+	def _apply_record(self, record):
+		customerId = record['customerId']
+		entry = self._pending.get(customerId)
+		if record.get('discard'):
+			self._pending.pop(customerId, None)
+		elif record.get('written'):
+			# Written up to seq, a later update to the customer stays pending
+			if entry and entry[0] <= record['seq']:
+				del self._pending[customerId]
+		else:
+			attributes = dict(entry[1]) if entry else {}
+			attributes.update(record['attributes'])
+			# Assigning an existing key keeps its place in the queue
+			self._pending[customerId] = (record['seq'], attributes)
+
+	def _append(self, records):
+		for record in records:
+			self._journal.write(json.dumps(record) + '\n')
+		self._journal.flush()
+		os.fsync(self._journal.fileno())
+		self._records += len(records)
+
+	def _compact(self):
+		"""Rewrites the journal with only the pending updates, one per customer"""
+		if self._journal is not None:
+			self._journal.close()
+		try:
+			tmp_path = self.journal_path + '.tmp'
+			with open(tmp_path, 'w') as f:
+				for customerId, (seq, attributes) in self._pending.items():
+					f.write(json.dumps({'seq': seq, 'customerId': customerId, 'attributes': attributes}) + '\n')
+				f.flush()
+				os.fsync(f.fileno())
+			os.replace(tmp_path, self.journal_path)
+			self._records = len(self._pending)
+		finally:
+			# Whatever happened the journal is usable again, a failed compaction
+			# leaves the old file in place
+			self._journal = open(self.journal_path, 'a')
+
+	def submit(self, customerId, attributes):
+		"""Journals an update and returns the customer's merged pending attributes"""
+		with self._lock:
+			self._seq += 1
+			record = {'seq': self._seq, 'customerId': customerId, 'attributes': attributes}
+			self._append([record])
+			self._apply_record(record)
+			return dict(self._pending[customerId][1])
+
+	def discard(self, customerId):
+		"""Drops the pending updates of a customer, e.g. once it is deleted"""
+		self.recent.forget(customerId)
+		with self._lock:
+			if customerId not in self._pending:
+				return
+			self._seq += 1
+			record = {'seq': self._seq, 'customerId': customerId, 'discard': True}
+			self._append([record])
+			self._apply_record(record)
+
+	def pending(self, customerId):
+		"""Returns the attributes not yet written for a customer, or None"""
+		with self._lock:
+			entry = self._pending.get(customerId)
+			return dict(entry[1]) if entry else None
+
+	def flush(self, max_writes=None):
+		"""
+		Writes up to max_writes pending updates, oldest first, stopping early
+		if the table is throttling. Returns the number written.
+		"""
+		written = 0
+		throttled = False
+		with self._flush_lock:
+			with self._lock:
+				entries = list(self._pending.items())
+			if max_writes is not None:
+				entries = entries[:max_writes]
+			for start in range(0, len(entries), self.batch_size):
+				done = []
+				for customerId, (seq, attributes) in entries[start:start + self.batch_size]:
+					try:
+						self.apply_update(customerId, attributes)
+					except Exception as e:
+						# Left pending and retried on the next flush
+						logger.error(e)
+						if 'Throttled' in e.args:
+							throttled = True
+							break
+						continue
+					done.append({'seq': seq, 'customerId': customerId, 'written': True})
+				if done:
+					with self._lock:
+						self._append(done)
+						for record in done:
+							self._apply_record(record)
+						if self._records >= self.compact_every:
+							self._compact()
+				written += len(done)
+				if throttled:
+					break
+		if throttled:
+			self._backoff = min(MAX_BACKOFF, max(self.flush_interval, self._backoff * 2))
+		else:
+			self._backoff = 0.0
+		return written
+
+	def _writes_per_flush(self):
+		if self.max_writes_per_second is None:
+			return None
+		return max(1, int(self.max_writes_per_second * self.flush_interval))
+
+	def _run(self):
+		while not self._stop.wait(self.flush_interval + self._backoff):
+			try:
+				self.flush(self._writes_per_flush())
+			except Exception as e:
+				logger.error(e)
+
+	def start(self):
+		self._worker = threading.Thread(target=self._run, name='write-behind', daemon=True)
+		self._worker.start()
+
+	def close(self):
+		"""Stops the worker, writes what is still pending and releases the journal"""
+		if self._closed:
+			return
+		self._closed = True
+		self._stop.set()
+		if self._worker is not None:
+			self._worker.join()
+		try:
+			self.flush()
+		finally:
+			with self._lock:
+				self._journal.close()
+			self._lock_file.close()
+
+def create_buffer(apply_update):
+	"""
+	Builds and starts the buffer from the WRITE_BEHIND_* environment. Returns
+	None when disabled, or when another process owns the journal, in which
+	case updates are written synchronously.
+
+	Pending updates are only visible to the process holding them, so this
+	refuses to start unless WRITE_BEHIND_SINGLE_REPLICA says every request
+	is served by this one replica, see kubernetes/statefulset-write-behind.yml
+	"""
+	if os.environ.get("WRITE_BEHIND_ENABLED", "false").lower() != 'true':
+		return None
+	if os.environ.get("WRITE_BEHIND_SINGLE_REPLICA", "false").lower() != 'true':
+		raise Exception('WriteBehindRequiresSingleReplica')
+	max_writes_per_second = os.environ.get("WRITE_BEHIND_MAX_WRITES_PER_SECOND", 5)
+	try:
+		buffer = WriteBehindBuffer(
+			os.environ.get("WRITE_BEHIND_JOURNAL", 'write-behind.journal'),
+			apply_update,
+			float(os.environ.get("WRITE_BEHIND_FLUSH_INTERVAL", 1.0)),
+			int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", 25)),
+			float(max_writes_per_second) if max_writes_per_second else None
+		)
+	except Exception as e:
+		if 'JournalLocked' not in e.args:
+			raise
+		logger.error("Write-behind journal is owned by another process, writing updates synchronously")
+		return None
+	buffer.start()
+	return buffer
+
+_buffer = None
+
+def configure(buffer):
+	"""Sets the buffer used by customer_table_client, None writes synchronously"""
+	global _buffer
+	_buffer = buffer
+
+def get_buffer():
+	return _buffer
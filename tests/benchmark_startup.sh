@@ -0,0 +1,26 @@
+#!/bin/bash
+
+# Measures the cold start of the service using python -X importtime.
+# Run from the repository root, the slowest imports are printed last.
+
+runs=${1:-5}
+
+echo "import time of the flaskr package (top 15 cumulative, microseconds)"
+echo "-------------------------------------------------------------------"
+python -X importtime -c "import flaskr" 2>&1 \
+  | grep "import time:" \
+  | sort -t '|' -k 2 -n \
+  | tail -15
+echo
+
+echo "create_app() wall time over $runs cold processes"
+echo "------------------------------------------------"
+for i in $(seq 1 $runs); do
+  python -c "
+import time
+start = time.perf_counter()
+from flaskr import create_app
+create_app()
+print('%.1f ms' % ((time.perf_counter() - start) * 1000))
+"
+done
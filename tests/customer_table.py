@@ -0,0 +1,44 @@
+import json
+import os
+import unittest
+from unittest import mock
+
+import boto3
+from moto import mock_dynamodb2
+
+from flaskr.db import reset_resources
+
+THIS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+with open(os.path.join(THIS_FOLDER, 'customers.json')) as f:
+	customers = json.load(f)
+
+class CustomerTableTestCase(unittest.TestCase):
+	"""
+	Runs each test against a mocked customers table, in the region the app
+	reads from, holding the first customer from tests/customers.json
+	"""
+	def setUp(self):
+		env = mock.patch.dict(os.environ, {
+			'AWS_ACCESS_KEY_ID': 'testing',
+			'AWS_SECRET_ACCESS_KEY': 'testing'
+		})
+		env.start()
+		self.addCleanup(env.stop)
+
+		dynamodb_mock = mock_dynamodb2()
+		dynamodb_mock.start()
+		self.addCleanup(dynamodb_mock.stop)
+
+		reset_resources()
+		self.addCleanup(reset_resources)
+
+		dynamodb = boto3.resource('dynamodb', 'ap-southeast-1')
+		self.table = dynamodb.create_table(
+			TableName='customers',
+			KeySchema=[{'AttributeName': 'customerId', 'KeyType': 'HASH'}],
+			AttributeDefinitions=[{'AttributeName': 'customerId', 'AttributeType': 'S'}],
+			ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+		)
+		self.customer = customers[0]
+		self.table.put_item(Item=self.customer)
@@ -4,7 +4,8 @@ import boto3
 import sys 
 from moto import mock_dynamodb2
 from flaskr.customer_table_client import get_all_customers, get_customer, \
-	create_customer, update_customer, delete_customer
+	create_customer, update_customer, delete_customer, parse_fields
+from tests.customer_table import CustomerTableTestCase
 import json
 import os
 
@@ -126,4 +127,40 @@ class TestDynamo(unittest.TestCase):
 		# 		# check if the customerId matches the deleted object
 		# 		self.assertEqual(deletedId, self.test_delete_customer_id)
 		# 		# check if the customer exists will fail if existing
-		# 		self.assertEqual(json.loads(customerGet)['customers']['status'], "Customer not found")
\ No newline at end of file
+		# 		self.assertEqual(json.loads(customerGet)['customers']['status'], "Customer not found")
+
+class TestFieldProjection(CustomerTableTestCase):
+	def test_parse_fields(self):
+		self.assertIsNone(parse_fields(None))
+		self.assertIsNone(parse_fields(' , '))
+		self.assertEqual(parse_fields('firstName, customerId,firstName'), ['firstName', 'customerId'])
+		with self.assertRaises(Exception) as context:
+			parse_fields('firstName,password')
+		self.assertIn('InvalidFields', context.exception.args)
+
+	def test_get_all_customers_with_fields(self):
+		response = json.loads(get_all_customers(['customerId', 'firstName']))
+		self.assertEqual(response['customers'], [{
+			'customerId': self.customer['customerId'],
+			'firstName': self.customer['firstName']
+		}])
+
+	def test_get_customer_with_fields(self):
+		response = json.loads(get_customer(self.customer['customerId'], ['lastName', 'address']))
+		self.assertEqual(response['customer'], {'lastName': self.customer['lastName'], 'address': {}})
+
+	def test_get_missing_customer_with_fields(self):
+		with self.assertRaises(Exception) as context:
+			get_customer('does-not-exist', ['firstName'])
+		self.assertIn('CustomerNotFound', context.exception.args)
+
+class TestDeleteCustomer(CustomerTableTestCase):
+	def test_delete_customer(self):
+		customerId = self.customer['customerId']
+		self.assertEqual(json.loads(delete_customer(customerId))['customer']['customerId'], customerId)
+		self.assertNotIn('Item', self.table.get_item(Key={'customerId': customerId}))
+
+	def test_delete_missing_customer(self):
+		with self.assertRaises(Exception) as context:
+			delete_customer('does-not-exist')
+		self.assertIn('CustomerNotFound', context.exception.args)
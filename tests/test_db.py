@@ -1,8 +1,9 @@
 import boto3
 import moto
+import threading
 import unittest
 
-from flaskr.db import get_db_resource
+from flaskr.db import get_db_client, get_db_resource, get_s3_resource, reset_resources
 
 class TestDb(unittest.TestCase):
 	def set_up():
@@ -10,4 +11,16 @@ class TestDb(unittest.TestCase):
 
 	def test_get_db_resource(self):
 		dynamodb = get_db_resource()
-		self.assertEqual(dynamodb._endpoint.host, 'https://dynamodb.ap-southeast-2.amazonaws.com')
\ No newline at end of file
+		self.assertEqual(dynamodb._endpoint.host, 'https://dynamodb.ap-southeast-2.amazonaws.com')
+
+	def test_threads_share_one_client(self):
+		reset_resources()
+		resources = []
+		thread = threading.Thread(target=lambda: resources.append(get_db_resource()))
+		thread.start()
+		thread.join()
+		resource = get_db_resource()
+		self.assertIsNot(resources[0], resource)
+		self.assertIs(resources[0].meta.client, resource.meta.client)
+		self.assertIs(resource.meta.client, get_db_client())
+		self.assertIs(get_s3_resource().meta.client, get_s3_resource().meta.client)
@@ -0,0 +1,111 @@
+import os
+import unittest
+from unittest import mock
+
+from flaskr import create_app
+from flaskr import rate_limiter
+from flaskr.rate_limiter import MemoryBackend, RateLimiter
+from tests.customer_table import CustomerTableTestCase
+
+class FakeClock:
+	def __init__(self):
+		self.now = 0.0
+
+	def __call__(self):
+		return self.now
+
+class TestRateLimiter(unittest.TestCase):
+	def setUp(self):
+		self.clock = FakeClock()
+		self.limiter = RateLimiter(MemoryBackend(self.clock), capacity=10, refill_rate=1)
+
+	def tearDown(self):
+		rate_limiter.configure(None)
+
+	def test_scans_cost_more_than_point_reads(self):
+		self.assertIsNone(self.limiter.check('ip:1', 'customers.get_all_customers'))
+		self.assertEqual(self.limiter.check('ip:1', 'customers.get_all_customers'), 10)
+		self.clock.now = 1
+		self.assertIsNone(self.limiter.check('ip:1', 'customers.get_customer'))
+
+	def test_buckets_refill(self):
+		for _ in range(10):
+			self.assertIsNone(self.limiter.check('ip:1', 'customers.get_customer'))
+		self.assertEqual(self.limiter.check('ip:1', 'customers.get_customer'), 1)
+		self.clock.now = 1
+		self.assertIsNone(self.limiter.check('ip:1', 'customers.get_customer'))
+
+	def test_clients_have_separate_buckets(self):
+		self.limiter.check('ip:1', 'customers.get_all_customers')
+		self.assertIsNone(self.limiter.check('ip:2', 'customers.get_all_customers'))
+
+	def test_health_check_is_free(self):
+		self.limiter.check('ip:1', 'customers.get_all_customers')
+		self.assertIsNone(self.limiter.check('ip:1', 'customers.health_check'))
+
+	def test_backend_errors_fail_open(self):
+		class BrokenBackend:
+			def consume(self, key, cost, capacity, refill_rate):
+				raise ConnectionError('backend is down')
+		limiter = RateLimiter(BrokenBackend(), capacity=10, refill_rate=1)
+		self.assertIsNone(limiter.check('ip:1', 'customers.get_all_customers'))
+
+	def test_least_recently_used_bucket_is_evicted(self):
+		backend = MemoryBackend(self.clock, max_keys=2)
+		limiter = RateLimiter(backend, capacity=10, refill_rate=1)
+		limiter.check('ip:1', 'customers.get_all_customers')
+		limiter.check('ip:2', 'customers.get_customer')
+		limiter.check('ip:1', 'customers.get_customer')
+		limiter.check('ip:3', 'customers.get_customer')
+		self.assertEqual(list(backend._buckets), ['ip:1', 'ip:3'])
+
+class FakeRequest:
+	def __init__(self, api_key=None, remote_addr='10.0.0.1'):
+		self.headers = {'X-Api-Key': api_key} if api_key else {}
+		self.remote_addr = remote_addr
+
+class TestClientKey(unittest.TestCase):
+	def setUp(self):
+		self.limiter = RateLimiter(MemoryBackend(), capacity=10, refill_rate=1, api_keys=['known'])
+
+	def test_configured_api_key_gets_its_own_bucket(self):
+		self.assertTrue(self.limiter.client_key(FakeRequest('known')).startswith('key:'))
+
+	def test_unknown_api_keys_share_the_ip_bucket(self):
+		allowed = 0
+		for i in range(1000):
+			key = self.limiter.client_key(FakeRequest('random-%d' % i))
+			self.assertEqual(key, 'ip:10.0.0.1')
+			if self.limiter.check(key, 'customers.get_all_customers') is None:
+				allowed += 1
+		self.assertEqual(allowed, 1)
+
+class TestRateLimitedRoutes(CustomerTableTestCase):
+	def tearDown(self):
+		rate_limiter.configure(None)
+
+	def test_limited_request_returns_429(self):
+		rate_limiter.configure(RateLimiter(MemoryBackend(), capacity=1, refill_rate=0.5))
+		client = create_app().test_client()
+		client.delete('/customers/1')
+		response = client.delete('/customers/1')
+		self.assertEqual(response.status_code, 429)
+		self.assertEqual(response.headers['Retry-After'], '2')
+
+	def test_client_ip_comes_from_trusted_proxy(self):
+		rate_limiter.configure(RateLimiter(MemoryBackend(), capacity=1, refill_rate=0.5))
+		with mock.patch.dict(os.environ, {'TRUSTED_PROXY_COUNT': '1'}):
+			client = create_app().test_client()
+		client.delete('/customers/1', headers={'X-Forwarded-For': '203.0.113.1'})
+		response = client.delete('/customers/1', headers={'X-Forwarded-For': '203.0.113.2'})
+		self.assertNotEqual(response.status_code, 429)
+
+	def test_misconfigured_backend_fails_at_startup(self):
+		rate_limiter.reset()
+		with mock.patch.dict(os.environ, {
+			'RATE_LIMIT_ENABLED': 'true',
+			'RATE_LIMIT_BACKEND': 'redis',
+			'RATE_LIMIT_REDIS_URL': 'not-a-redis-url'
+		}):
+			with self.assertRaises(ValueError):
+				create_app()
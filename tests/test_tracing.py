@@ -0,0 +1,94 @@
+import json
+import os
+import tempfile
+import unittest
+
+from flask import Flask
+
+from flaskr import tracing
+
+class RecordingExporter:
+	def __init__(self):
+		self.traces = []
+
+	def export(self, trace):
+		self.traces.append(trace)
+
+class TestTracing(unittest.TestCase):
+	def setUp(self):
+		self.exporter = RecordingExporter()
+		self.app = Flask(__name__)
+		sampler = tracing.Sampler(0.0, {'/sampled': 1.0})
+		tracing.init_app(self.app, self.exporter, sampler)
+
+		@self.app.route('/sampled')
+		def sampled():
+			with tracing.span('dynamodb.get_item', table='customers') as span:
+				span.record_dynamodb({'Item': {}, 'ConsumedCapacity': {'CapacityUnits': 0.5}})
+			return 'ok'
+
+		@self.app.route('/unsampled')
+		def unsampled():
+			with tracing.span('dynamodb.scan') as span:
+				self.assertIs(span, tracing.NULL_SPAN)
+			return 'ok'
+
+		self.client = self.app.test_client()
+
+	def test_parse_route_rates(self):
+		rates = tracing.parse_route_rates('/customers=0.01, /customers/<string:customerId>=0.1')
+		self.assertEqual(rates, {'/customers': 0.01, '/customers/<string:customerId>': 0.1})
+
+	def test_sampled_route_records_spans(self):
+		self.client.get('/sampled')
+		self.assertEqual(len(self.exporter.traces), 1)
+		trace = self.exporter.traces[0]
+		self.assertEqual(trace.root.attributes['http.status_code'], 200)
+		self.assertEqual(trace.spans[0].attributes, {
+			'table': 'customers', 'item_count': 1, 'consumed_capacity': 0.5})
+
+	def test_unsampled_route_is_not_exported(self):
+		self.client.get('/unsampled')
+		self.assertEqual(self.exporter.traces, [])
+
+	def test_upstream_header_is_ignored_by_default(self):
+		self.client.get('/unsampled', headers={
+			'X-Amzn-Trace-Id': 'Root=1-5759e988-bd862e3fe1be46a994272793;Sampled=1'})
+		self.assertEqual(self.exporter.traces, [])
+
+	def test_trusted_upstream_sampling_decision_is_honoured(self):
+		app = Flask(__name__)
+		tracing.init_app(app, self.exporter, tracing.Sampler(0.0), trust_upstream=True)
+		app.add_url_rule('/', 'index', lambda: 'ok')
+		app.test_client().get('/', headers={
+			'X-Amzn-Trace-Id': 'Root=1-5759e988-bd862e3fe1be46a994272793;Sampled=1'})
+		self.assertEqual(self.exporter.traces[0].trace_id, '5759e988bd862e3fe1be46a994272793')
+
+	def test_file_exporter(self):
+		path = os.path.join(tempfile.mkdtemp(), 'traces.jsonl')
+		trace = tracing.Trace('GET /customers')
+		trace.start_span('dynamodb.scan').finish()
+		trace.root.finish()
+		tracing.FileExporter(path).export(trace)
+		with open(path) as f:
+			spans = json.loads(f.readline())['spans']
+		self.assertEqual([s['name'] for s in spans], ['GET /customers', 'dynamodb.scan'])
+		self.assertEqual(spans[1]['parent_id'], spans[0]['span_id'])
+
+	def test_xray_segment(self):
+		trace = tracing.Trace('GET /customers')
+		trace.start_span('dynamodb.scan').finish()
+		trace.root.finish()
+		segment = tracing.XRayDaemonExporter('127.0.0.1:2000').segment(trace)
+		self.assertRegex(segment['trace_id'], r'^1-[0-9a-f]{8}-[0-9a-f]{24}$')
+		self.assertEqual(segment['subsegments'][0]['name'], 'dynamodb.scan')
+
+	def test_xray_daemon_address_is_resolved_once(self):
+		exporter = tracing.XRayDaemonExporter('localhost:2000')
+		self.assertEqual(exporter.address, ('127.0.0.1', 2000))
+
+	def test_unmatched_urls_share_one_route(self):
+		app = Flask(__name__)
+		tracing.init_app(app, self.exporter, tracing.Sampler(0.0, {'<unmatched>': 1.0}))
+		app.test_client().get('/does/not/exist')
+		self.assertEqual(self.exporter.traces[0].root.name, 'GET <unmatched>')
@@ -0,0 +1,228 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from flaskr import write_behind
+from flaskr.customer_table_client import get_customer, update_customer, flush_update
+from flaskr.write_behind import WriteBehindBuffer, create_buffer
+from tests.customer_table import CustomerTableTestCase
+
+class TestWriteBehindBuffer(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.journal_path = os.path.join(self.directory, 'write-behind.journal')
+		self.written = []
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def apply_update(self, customerId, attributes):
+		self.written.append((customerId, attributes))
+
+	def test_updates_are_coalesced(self):
+		buffer = WriteBehindBuffer(self.journal_path, self.apply_update)
+		buffer.submit('1', {'firstName': 'a', 'lastName': 'b'})
+		buffer.submit('2', {'firstName': 'c'})
+		self.assertEqual(buffer.submit('1', {'firstName': 'd'}), {'firstName': 'd', 'lastName': 'b'})
+		self.assertEqual(buffer.flush(), 2)
+		# '1' keeps the place of its first update
+		self.assertEqual(self.written, [
+			('1', {'firstName': 'd', 'lastName': 'b'}),
+			('2', {'firstName': 'c'})
+		])
+		self.assertIsNone(buffer.pending('1'))
+
+	def test_edited_customer_is_not_starved(self):
+		buffer = WriteBehindBuffer(self.journal_path, self.apply_update)
+		for customerId in '123':
+			buffer.submit(customerId, {'firstName': 'a'})
+		for _ in range(3):
+			buffer.submit('1', {'firstName': 'b'})
+			buffer.flush(1)
+		self.assertEqual([customerId for customerId, _ in self.written], ['1', '2', '3'])
+
+	def test_pending_updates_survive_a_restart(self):
+		buffer = WriteBehindBuffer(self.journal_path, self.apply_update)
+		buffer.submit('1', {'firstName': 'a'})
+		buffer.submit('1', {'lastName': 'b'})
+		buffer.submit('2', {'firstName': 'c'})
+		buffer.discard('2')
+		# simulate a crash part way through appending a record, the lock
+		# goes with the crashed process
+		with open(self.journal_path, 'a') as f:
+			f.write('{"seq": 5, "custo')
+		buffer._lock_file.close()
+
+		recovered = WriteBehindBuffer(self.journal_path, self.apply_update)
+		self.assertEqual(recovered.pending('1'), {'firstName': 'a', 'lastName': 'b'})
+		self.assertIsNone(recovered.pending('2'))
+		recovered.flush()
+		recovered._lock_file.close()
+		self.assertIsNone(WriteBehindBuffer(self.journal_path, self.apply_update).pending('1'))
+
+	def test_written_updates_are_acknowledged(self):
+		buffer = WriteBehindBuffer(self.journal_path, self.apply_update, compact_every=5)
+		buffer.submit('1', {'firstName': 'a'})
+		buffer.submit('2', {'firstName': 'b'})
+		buffer.flush(1)
+		buffer.submit('2', {'firstName': 'c'})
+		with open(self.journal_path) as f:
+			self.assertEqual(len(f.readlines()), 4)
+		buffer._lock_file.close()
+
+		recovered = WriteBehindBuffer(self.journal_path, self.apply_update, compact_every=5)
+		self.assertIsNone(recovered.pending('1'))
+		self.assertEqual(recovered.pending('2'), {'firstName': 'c'})
+		for customerId in '345':
+			recovered.submit(customerId, {'firstName': 'd'})
+		# the fifth record since recovery compacts the journal down to the pending updates
+		recovered.flush(1)
+		with open(self.journal_path) as f:
+			self.assertEqual(len(f.readlines()), 3)
+
+	def test_failed_compaction_keeps_the_journal_open(self):
+		buffer = WriteBehindBuffer(self.journal_path, self.apply_update, compact_every=2)
+		buffer.submit('1', {'firstName': 'a'})
+		with mock.patch('os.replace', side_effect=OSError('No space left on device')):
+			with self.assertRaises(OSError):
+				buffer.flush()
+		buffer.submit('2', {'firstName': 'b'})
+		buffer.flush()
+		self.assertEqual(len(self.written), 2)
+		buffer.close()
+
+	def test_requires_a_single_replica(self):
+		environ = {'WRITE_BEHIND_ENABLED': 'true', 'WRITE_BEHIND_JOURNAL': self.journal_path}
+		with mock.patch.dict(os.environ, environ):
+			with self.assertRaises(Exception) as context:
+				create_buffer(self.apply_update)
+			self.assertIn('WriteBehindRequiresSingleReplica', context.exception.args)
+			with mock.patch.dict(os.environ, {'WRITE_BEHIND_SINGLE_REPLICA': 'true'}):
+				create_buffer(self.apply_update).close()
+
+	def test_failed_updates_are_retried(self):
+		attempts = []
+		def flaky_update(customerId, attributes):
+			attempts.append(customerId)
+			if len(attempts) == 1:
+				raise Exception('ProvisionedThroughputExceeded')
+		buffer = WriteBehindBuffer(self.journal_path, flaky_update)
+		buffer.submit('1', {'firstName': 'a'})
+		self.assertEqual(buffer.flush(), 0)
+		self.assertEqual(buffer.pending('1'), {'firstName': 'a'})
+		self.assertEqual(buffer.flush(), 1)
+		self.assertIsNone(buffer.pending('1'))
+
+	def test_update_during_flush_stays_pending(self):
+		buffer = None
+		def slow_update(customerId, attributes):
+			if attributes == {'firstName': 'a'}:
+				thread = threading.Thread(target=buffer.submit, args=('1', {'firstName': 'b'}))
+				thread.start()
+				thread.join()
+		buffer = WriteBehindBuffer(self.journal_path, slow_update)
+		buffer.submit('1', {'firstName': 'a'})
+		buffer.flush()
+		self.assertEqual(buffer.pending('1'), {'firstName': 'b'})
+
+	def test_journal_is_owned_by_one_buffer(self):
+		buffer = WriteBehindBuffer(self.journal_path, self.apply_update)
+		with self.assertRaises(Exception) as context:
+			WriteBehindBuffer(self.journal_path, self.apply_update)
+		self.assertIn('JournalLocked', context.exception.args)
+		buffer.close()
+		WriteBehindBuffer(self.journal_path, self.apply_update).close()
+
+	def test_writes_per_flush_are_capped(self):
+		buffer = WriteBehindBuffer(self.journal_path, self.apply_update, max_writes_per_second=2)
+		for customerId in '12345':
+			buffer.submit(customerId, {'firstName': 'a'})
+		self.assertEqual(buffer.flush(buffer._writes_per_flush()), 2)
+		self.assertEqual([customerId for customerId, _ in self.written], ['1', '2'])
+		self.assertEqual(buffer.flush(buffer._writes_per_flush()), 2)
+
+	def test_throttling_backs_off(self):
+		def throttled_update(customerId, attributes):
+			raise Exception('Throttled')
+		buffer = WriteBehindBuffer(self.journal_path, throttled_update)
+		buffer.submit('1', {'firstName': 'a'})
+		buffer.submit('2', {'firstName': 'b'})
+		modified = os.stat(self.journal_path).st_mtime_ns
+		self.assertEqual(buffer.flush(), 0)
+		self.assertEqual(buffer._backoff, 1.0)
+		buffer.flush()
+		self.assertEqual(buffer._backoff, 2.0)
+		# nothing was written, so the journal is left alone
+		self.assertEqual(os.stat(self.journal_path).st_mtime_ns, modified)
+		buffer.apply_update = self.apply_update
+		buffer.flush()
+		self.assertEqual(buffer._backoff, 0.0)
+
+class TestWriteBehindCustomerTable(CustomerTableTestCase):
+	def setUp(self):
+		super().setUp()
+		self.directory = tempfile.mkdtemp()
+		self.buffer = WriteBehindBuffer(os.path.join(self.directory, 'write-behind.journal'), flush_update)
+		write_behind.configure(self.buffer)
+
+	def tearDown(self):
+		write_behind.configure(None)
+		self.buffer.close()
+		shutil.rmtree(self.directory)
+
+	def customer_dict(self, firstName):
+		return dict(self.customer, firstName=firstName, address1='1 Main St', address2='',
+			city='Sydney', region='NSW', country='Australia', zipCode='2000')
+
+	def test_reads_see_pending_updates(self):
+		customerId = self.customer['customerId']
+		update_customer(customerId, self.customer_dict('First'))
+		update_customer(customerId, self.customer_dict('Second'))
+
+		stored = self.table.get_item(Key={'customerId': customerId})['Item']
+		self.assertEqual(stored['firstName'], self.customer['firstName'])
+		self.assertEqual(json.loads(get_customer(customerId))['customer']['firstName'], 'Second')
+
+		self.assertEqual(self.buffer.flush(), 1)
+		stored = self.table.get_item(Key={'customerId': customerId})['Item']
+		self.assertEqual(stored['firstName'], 'Second')
+		self.assertEqual(stored['address']['city'], 'Sydney')
+
+	def test_response_matches_synchronous_mode(self):
+		customerId = self.customer['customerId']
+		buffered = json.loads(update_customer(customerId, self.customer_dict('First')))
+		write_behind.configure(None)
+		synchronous = json.loads(update_customer(customerId, self.customer_dict('First')))
+		del buffered['customer']['updatedDate'], synchronous['customer']['updatedDate']
+		self.assertEqual(buffered, synchronous)
+
+	def test_missing_customer_is_not_found(self):
+		for buffer in (self.buffer, None):
+			write_behind.configure(buffer)
+			with self.assertRaises(Exception) as context:
+				update_customer('does-not-exist', self.customer_dict('First'))
+			self.assertIn('CustomerNotFound', context.exception.args)
+		self.assertIsNone(self.buffer.pending('does-not-exist'))
+		self.assertNotIn('Item', self.table.get_item(Key={'customerId': 'does-not-exist'}))
+
+	def test_update_after_read_skips_the_table(self):
+		customerId = self.customer['customerId']
+		get_customer(customerId)
+		with mock.patch('flaskr.customer_table_client.get_db_resource') as get_db_resource:
+			customer = json.loads(update_customer(customerId, self.customer_dict('First')))['customer']
+		get_db_resource.return_value.Table.return_value.get_item.assert_not_called()
+		self.assertEqual(customer['lastName'], self.customer['lastName'])
+		self.assertEqual(customer['firstName'], 'First')
+
+	def test_update_reads_eventually_consistent(self):
+		customerId = self.customer['customerId']
+		table = mock.MagicMock()
+		table.get_item.return_value = {'Item': {'customerId': customerId}}
+		with mock.patch('flaskr.customer_table_client.get_db_resource') as get_db_resource:
+			get_db_resource.return_value.Table.return_value = table
+			update_customer(customerId, self.customer_dict('First'))
+		self.assertNotIn('ConsistentRead', table.get_item.call_args[1])